@@ -15,6 +15,13 @@ class CarControl:
 
         self.servo_cam = bx
 
+    def get_control(self):
+        return {
+            "steering": self.steering,
+            "throttle": self.throttle,
+            "servo_cam": self.servo_cam
+        }
+
 
 class RGT_control(CarControl):
     def __init__(self):
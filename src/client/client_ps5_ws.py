@@ -1,121 +1,205 @@
 # client_ps5_ws.py
-import pygame, asyncio, websockets, json, time, os, ssl
+import pygame, asyncio, websockets, json, time, os, ssl, hmac, hashlib
 
-from car_control import RGT_control
+from car_control import CarControl, RGT_control
 import sys
 
 WS_URL = os.getenv("WS_URL", "ws://100.95.67.37:8443")
 TOKEN  = os.getenv("TOKEN", "my-super-secret")
+# One "car:Profile" per joystick, in joystick order. Car ids must match the relay's CARS
+# (a relay without CARS has a single car called "car").
+BINDINGS = os.getenv("BINDINGS", "car:RGT_control")
 
 SEND_HZ = 40
-
-pygame.init(); pygame.joystick.init()
-if pygame.joystick.get_count() == 0:
-    raise SystemExit("No joystick found")
-joy = pygame.joystick.Joystick(0); joy.init()
-print("Joystick:", joy.get_name())
-
-controls = RGT_control()
-
-def read_state():
-    pygame.event.pump()
-    # Different pygame axis ordering on macOS (Darwin). Adjust indices if your device differs.
-    if sys.platform == "darwin":
-        try:
+ACQUIRE_RETRY_S = 2.0  # re-request cars we were refused (busy) this often
+
+PROFILES = {"CarControl": CarControl, "RGT_control": RGT_control}
+
+class Controller:
+    """One joystick bound to one car and its CarControl profile."""
+
+    def __init__(self, joy, car, controls):
+        self.joy = joy
+        self.car = car
+        self.controls = controls
+
+    def read(self):
+        """Sample the joystick (after pygame.event.pump()) and return this car's channel frame."""
+        joy = self.joy
+        # Different pygame axis ordering on macOS (Darwin). Adjust indices if your device differs.
+        if sys.platform == "darwin":
+            try:
+                ax = joy.get_axis(0)   # left stick X
+                ay = -joy.get_axis(1)  # left stick Y (invert)
+                bx = joy.get_axis(2)   # right stick X
+                by = -joy.get_axis(3)  # right stick Y (invert)
+                lg = joy.get_axis(4)   # left trigger
+                rg = joy.get_axis(5)   # right trigger
+
+                buttons = { "cross": joy.get_button(0) , "square": joy.get_button(2), "round": joy.get_button(1), "triangle": joy.get_button(3), "lb": joy.get_button(9), "rb": joy.get_button(10), "left_stick": joy.get_button(7), "right_stick": joy.get_button(8), "flash": joy.get_button(4), "menu": joy.get_button(6) }
+
+            except Exception:
+                ax = ay = lg = bx = by = rg = 0.0
+                buttons = {}
+        else:
             ax = joy.get_axis(0)   # left stick X
             ay = -joy.get_axis(1)  # left stick Y (invert)
-            bx = joy.get_axis(2)   # right stick X
-            by = -joy.get_axis(3)  # right stick Y (invert)
-            lg = joy.get_axis(4)   # left trigger
+            lg = joy.get_axis(2)   # left trigger
+            bx = joy.get_axis(3)   # right stick X
+            by = -joy.get_axis(4)  # right stick Y (invert)
             rg = joy.get_axis(5)   # right trigger
 
-            buttons = { "cross": joy.get_button(0) , "square": joy.get_button(2), "round": joy.get_button(1), "triangle": joy.get_button(3), "lb": joy.get_button(9), "rb": joy.get_button(10), "left_stick": joy.get_button(7), "right_stick": joy.get_button(8), "flash": joy.get_button(4), "menu": joy.get_button(6) }
-
-        except Exception:
-            ax = ay = lg = bx = by = rg = 0.0
-    else:
-        ax = joy.get_axis(0)   # left stick X
-        ay = -joy.get_axis(1)  # left stick Y (invert)
-        lg = joy.get_axis(2)   # left trigger
-        bx = joy.get_axis(3)   # right stick X
-        by = -joy.get_axis(4)  # right stick Y (invert)
-        rg = joy.get_axis(5)   # right trigger
-
-        buttons = { "cross": joy.get_button(0) , "square": joy.get_button(3), "round": joy.get_button(1), "triangle": joy.get_button(2), "lb": joy.get_button(4), "rb": joy.get_button(5), "left_stick": joy.get_button(11), "right_stick": joy.get_button(12), "flash": joy.get_button(8), "menu": joy.get_button(9) }
-
-    
-
-    controls.update(ax, ay, lg, bx, by, rg, buttons)
-
-    calibrated_controls = controls.get_control()
-
-    return {"ch1": round(max(-1,min(1,calibrated_controls["steering"])),3),
-            "ch2": round(max(-1,min(1,calibrated_controls["throttle"])),3),
-            "ch3": round(max(-1,min(1,calibrated_controls["winch"])),3),
-            "ch4": round(max(-1,min(1,calibrated_controls["swaybar"])),3),
-            "ch5": round(max(-1,min(1,calibrated_controls["lights"])),3),
-            "ch6": round(max(-1,min(1,calibrated_controls["rotating_lights"])),3),
-            "ch7": round(max(-1,min(1,calibrated_controls["speed"])),3),
-            "ch8": round(max(-1,min(1,calibrated_controls["dig"])),3),
-            "ch9": round(max(-1,min(1,calibrated_controls["servo_cam"])),3),
-            "ts": time.time(),
-            "token": TOKEN}
+            buttons = { "cross": joy.get_button(0) , "square": joy.get_button(3), "round": joy.get_button(1), "triangle": joy.get_button(2), "lb": joy.get_button(4), "rb": joy.get_button(5), "left_stick": joy.get_button(11), "right_stick": joy.get_button(12), "flash": joy.get_button(8), "menu": joy.get_button(9) }
+
+        self.controls.update(ax, ay, lg, bx, by, rg, buttons)
+
+        calibrated_controls = self.controls.get_control()
+
+        def ch(name):
+            return round(max(-1,min(1,calibrated_controls.get(name, 0.0))),3)
+
+        return {"car": self.car,
+                "ch1": ch("steering"),
+                "ch2": ch("throttle"),
+                "ch3": ch("winch"),
+                "ch4": ch("swaybar"),
+                "ch5": ch("lights"),
+                "ch6": ch("rotating_lights"),
+                "ch7": ch("speed"),
+                "ch8": ch("dig"),
+                "ch9": ch("servo_cam")}
+
+def open_controllers():
+    """Enumerate all joysticks and bind them, in order, to the BINDINGS entries."""
+    pygame.init(); pygame.joystick.init()
+    if pygame.joystick.get_count() == 0:
+        raise SystemExit("No joystick found")
+    bindings = [b.strip().split(":") for b in BINDINGS.split(",") if b.strip()]
+    controllers = []
+    for i in range(pygame.joystick.get_count()):
+        joy = pygame.joystick.Joystick(i); joy.init()
+        if i >= len(bindings):
+            print(f"Joystick {i}: {joy.get_name()} (unbound, add it to BINDINGS)")
+            continue
+        car, profile = (bindings[i] + ["RGT_control"])[:2]
+        if profile not in PROFILES:
+            raise SystemExit(f"Unknown profile {profile!r} for car {car!r}; use one of {', '.join(PROFILES)}")
+        print(f"Joystick {i}: {joy.get_name()} -> {car} ({profile})")
+        controllers.append(Controller(joy, car, PROFILES[profile]()))
+    if not controllers:
+        raise SystemExit("No joystick bound; set BINDINGS")
+    return controllers
+
+controllers = open_controllers()
+
+def read_state(cars=None):
+    """Sample every controller (or only those bound to `cars`) in one pass and batch their frames."""
+    pygame.event.pump()
+    return {"type": "batch",
+            "frames": [c.read() for c in controllers if cars is None or c.car in cars],
+            "ts": time.time()}
+
+def legacy_packet(batch, extra):
+    """Relays that predate batching drive a single car: send the first frame the old way."""
+    frame = dict(batch["frames"][0])
+    del frame["car"]
+    return {**frame, "ts": batch["ts"], **extra}
+
+async def authenticate(ws):
+    """Answer the relay's hello challenge once per connection.
+
+    Returns extra fields to merge into every control packet: empty after an HMAC
+    handshake, or the legacy per-packet token for relays that send no nonce.
+    """
+    hello = json.loads(await ws.recv())
+    print("Server:", hello)
+    nonce = hello.get("nonce")
+    if not nonce:
+        return {"token": TOKEN}
+    mac = hmac.new(TOKEN.encode("utf-8"), nonce.encode("utf-8"), hashlib.sha256).hexdigest()
+    await ws.send(json.dumps({"type": "auth", "mac": mac}))
+    return {}
 
 async def run():
     # If you front with TLS, use wss:// and optionally an SSL context
     async with websockets.connect(WS_URL, max_size=2**16) as ws:
-        hello = await ws.recv()
-        print("Server:", hello)
+        extra = await authenticate(ws)
         try:
             while True:
-                pkt = json.dumps(read_state())
+                batch = read_state()
+                pkt = json.dumps(legacy_packet(batch, extra) if extra else batch)
                 await ws.send(pkt)
                 await asyncio.sleep(1/40)  # ~40Hz
         except KeyboardInterrupt:
             pass
 
 async def drive_once():
-    """Connect once, send acquire exactly once, then stream controls while driver."""
+    """Connect once, acquire every bound car, then stream the cars we drive in one batch per tick."""
     async with websockets.connect(WS_URL, max_size=2**16) as ws:
-        # 1) Send acquire ONCE per connection
-        await ws.send(json.dumps({"acquire": True, "token": TOKEN}))
-        role = "spectator"
-        acquired = False
+        # 1) Authenticate, then ask for each car
+        extra = await authenticate(ws)
+
+        async def acquire(cars):
+            if not cars:
+                return
+            if extra:
+                # legacy relay: single car, no "car" field
+                await ws.send(json.dumps({"acquire": True, **extra}))
+                return
+            for car in cars:
+                await ws.send(json.dumps({"acquire": True, "car": car}))
+
+        await acquire([c.car for c in controllers])
         print("Connected. Sent acquire request.")
 
-        # Optionally: wait up to 2s for server to confirm role
-        try:
-            async def wait_for_role():
-                nonlocal role, acquired
-                deadline = time.time() + 2.0
-                while time.time() < deadline:
-                    msg = await asyncio.wait_for(ws.recv(), timeout=0.2)
-                    pkt = json.loads(msg)
-                    if pkt.get("type") == "role":
-                        role = pkt.get("role", role)
-                        acquired = (role == "driver")
-                        print("Role:", role)
-                        return
-                    elif pkt.get("type") == "busy":
-                        print("Server says: busy (someone else is driving).")
-                        return
-                    # ignore other messages (hello, telemetry echoes, etc.)
-            await wait_for_role()
-        except asyncio.TimeoutError:
-            # no explicit role message; we can still start and let server ignore if not driver
-            pass
-
-        # 2) Main loop: send controls; only the driver will be honored
+        # car -> "driver" / "busy" / "error", from the relay's replies
+        roles = {}
+
+        async def listen():
+            async for msg in ws:
+                pkt = json.loads(msg)
+                # legacy relays answer without a car id: that is our one car
+                car = pkt.get("car", controllers[0].car)
+                if pkt.get("type") == "auth" and not pkt.get("ok"):
+                    print("Server rejected authentication (check TOKEN).")
+                elif pkt.get("type") == "role" and pkt.get("role") == "driver":
+                    if roles.get(car) != "driver":
+                        print("Role: driver", car)
+                    roles[car] = "driver"
+                elif pkt.get("type") in ("busy", "error"):
+                    if roles.get(car) != pkt.get("type"):
+                        print(f"Server says: {pkt.get('type')} for car {car} (someone else is driving or unknown id).")
+                    roles[car] = pkt.get("type")
+                # ignore other messages (hello, telemetry echoes, etc.)
+
+        listener = asyncio.create_task(listen())
+
+        # 2) Main loop: one batched message per tick, only for the cars we drive;
+        #    busy cars are asked for again every ACQUIRE_RETRY_S (unknown ids are not)
         try:
             period = 1.0 / SEND_HZ
-            while True:
-                st = read_state()
-                payload = st
-                await ws.send(json.dumps(payload))
-                await asyncio.sleep(period)
+            next_send = time.monotonic()
+            next_retry = next_send + ACQUIRE_RETRY_S
+            while not listener.done():
+                driving = {car for car, role in roles.items() if role == "driver"}
+                if driving:
+                    batch = read_state(driving)
+                    payload = legacy_packet(batch, extra) if extra else batch
+                    await ws.send(json.dumps(payload))
+                else:
+                    pygame.event.pump()
+                if time.monotonic() >= next_retry:
+                    next_retry = time.monotonic() + ACQUIRE_RETRY_S
+                    await acquire([c.car for c in controllers if roles.get(c.car) == "busy"])
+                # fixed-rate schedule so sampling time doesn't add up as jitter
+                next_send = max(next_send + period, time.monotonic() - period)
+                await asyncio.sleep(max(0.0, next_send - time.monotonic()))
         except websockets.ConnectionClosed:
-            print("Disconnected.")
-            return
+            pass
+        finally:
+            listener.cancel()
+            await asyncio.gather(listener, return_exceptions=True)
+        print("Disconnected.")
 
 async def main():
     # Simple reconnect loop with backoff
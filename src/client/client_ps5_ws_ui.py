@@ -21,6 +21,8 @@ import time
 import threading
 import asyncio
 import json
+import hmac
+import hashlib
 
 try:
     import tkinter as tk
@@ -170,10 +172,16 @@ class WebsocketSender(threading.Thread):
     async def _main(self):
         try:
             async with websockets.connect(WS_URL, max_size=2 ** 16) as ws:
-                # wait for hello
+                # wait for hello and answer its auth challenge (legacy relays send no nonce)
+                extra = {"token": TOKEN}
                 try:
                     hello = await asyncio.wait_for(ws.recv(), timeout=2.0)
                     print("Server:", hello)
+                    nonce = json.loads(hello).get("nonce")
+                    if nonce:
+                        mac = hmac.new(TOKEN.encode("utf-8"), nonce.encode("utf-8"), hashlib.sha256).hexdigest()
+                        await ws.send(json.dumps({"type": "auth", "mac": mac}))
+                        extra = {}
                 except Exception:
                     pass
                 while not self.stop_event.is_set():
@@ -188,7 +196,7 @@ class WebsocketSender(threading.Thread):
                         "ch7": round(max(-1, min(1, snap["speed"])), 3),
                         "ch8": round(max(-1, min(1, snap["dig"])), 3),
                         "ts": time.time(),
-                        "token": TOKEN,
+                        **extra,
                     }
                     try:
                         await ws.send(json.dumps(pkt))
@@ -66,6 +66,19 @@ unsigned long last_packet_ms = 0;
 const unsigned long FAILSAFE_MS = 500;
 bool armed = false;
 
+// ====== Ack back-channel ======
+// Packets carrying "seq" are acked to the sender: {"ack":seq,"armed":0|1,"fs":0|1,"rx":ms,"ap":ms}
+// fs = the car was in failsafe when the packet arrived; rx/ap = millis() at receive/apply.
+const unsigned long ACK_STATUS_MS = 200; // while in failsafe, repeat the last ack this often
+bool ack_pending = false;
+bool ack_seen = false;
+bool ack_fs = false;
+uint32_t ack_seq = 0;
+unsigned long ack_rx_ms = 0;
+unsigned long last_ack_ms = 0;
+IPAddress ack_ip;
+uint16_t ack_port = 0;
+
 // ====== Helpers ======
 uint16_t usToDuty(int pulse_us)
 {
@@ -161,6 +174,17 @@ void applyControls()
   writePulseUS(CAM_SERVO_CH, cam_us);
 }
 
+void sendAck(bool fs, unsigned long ap_ms)
+{
+  char out[96];
+  int n = snprintf(out, sizeof(out), "{\"ack\":%lu,\"armed\":%d,\"fs\":%d,\"rx\":%lu,\"ap\":%lu}",
+                   (unsigned long)ack_seq, armed ? 1 : 0, fs ? 1 : 0, ack_rx_ms, ap_ms);
+  Udp.beginPacket(ack_ip, ack_port);
+  Udp.write((const uint8_t *)out, n);
+  Udp.endPacket();
+  last_ack_ms = millis();
+}
+
 void armSequence()
 {
   // Hold neutral for 2s so most ESCs arm safely
@@ -233,7 +257,7 @@ void loop()
     if (len > 0)
     {
       buf[len] = 0;
-      StaticJsonDocument<200> doc;
+      StaticJsonDocument<256> doc;
       DeserializationError err = deserializeJson(doc, buf);
       if (!err)
       {
@@ -258,13 +282,25 @@ void loop()
         dig_cmd = constrain(dig, -1.0f, 1.0f);
         cam_cmd = constrain(cam, -1.0f, 1.0f);
 
+        if (doc.containsKey("seq"))
+        {
+          ack_seq = doc["seq"].as<uint32_t>();
+          ack_fs = millis() - last_packet_ms > FAILSAFE_MS;
+          ack_rx_ms = millis();
+          ack_ip = Udp.remoteIP();
+          ack_port = Udp.remotePort();
+          ack_pending = true;
+          ack_seen = true;
+        }
+
         last_packet_ms = millis();
       }
     }
   }
 
   // Failsafe
-  if (millis() - last_packet_ms > FAILSAFE_MS)
+  bool failsafe = millis() - last_packet_ms > FAILSAFE_MS;
+  if (failsafe)
   {
     sendNeutral();
   }
@@ -277,5 +313,15 @@ void loop()
     sendNeutral();
   }
 
+  if (ack_pending)
+  {
+    sendAck(ack_fs, millis());
+    ack_pending = false;
+  }
+  else if (failsafe && ack_seen && millis() - last_ack_ms > ACK_STATUS_MS)
+  {
+    sendAck(true, ack_rx_ms);
+  }
+
   delay(10); // 100 Hz loop
 }
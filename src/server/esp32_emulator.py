@@ -0,0 +1,104 @@
+"""
+Stand-in for rc_control_sketch.ino: listens for relay UDP packets and sends the same acks.
+
+Usage (relay with ESP32_ACK=1 ESP32_HOST=127.0.0.1 pointed at it):
+  ESP32_PORT=5005 DROP=0.05 DELAY_MS=3 python src/server/esp32_emulator.py
+
+Mirrors the sketch: channels are applied on receive, packets carrying "seq" are acked with
+{"ack": seq, "armed": 0|1, "fs": 0|1, "rx": ms, "ap": ms}, and while in failsafe the last ack is
+repeated every STATUS_MS so the relay can see the car sitting in neutral.
+"""
+import asyncio, json, os, random, time
+
+ESP32_BIND = os.getenv("ESP32_BIND", "127.0.0.1")
+ESP32_PORT = int(os.getenv("ESP32_PORT", "5005"))
+FAILSAFE_MS = 500
+STATUS_MS = 200
+
+
+def millis() -> int:
+    return int(time.monotonic() * 1000)
+
+
+class ESP32Emulator(asyncio.DatagramProtocol):
+    """drop: probability a packet is lost each way; delay_ms: one-way delay added to each ack."""
+
+    def __init__(self, drop=0.0, delay_ms=0.0, apply_ms=0, arm_ms=0):
+        self.drop = drop
+        self.delay_ms = delay_ms
+        self.apply_ms = apply_ms
+        self.armed_at = millis() + arm_ms
+        self.transport = None
+        self.channels = {}
+        self.received = []  # every packet that made it through, in order
+        self.last_packet_ms = 0
+        self.last_seq = None
+        self.last_rx = 0
+        self.remote = None
+
+    @property
+    def armed(self) -> bool:
+        return millis() >= self.armed_at
+
+    @property
+    def failsafe(self) -> bool:
+        return millis() - self.last_packet_ms > FAILSAFE_MS
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if random.random() < self.drop:
+            return
+        try:
+            pkt = json.loads(data)
+        except Exception:
+            return
+        rx = millis()
+        was_failsafe = self.failsafe
+        self.received.append(pkt)
+        self.channels = {f"ch{i}": pkt.get(f"ch{i}", 0.0) for i in range(1, 10)}
+        self.last_packet_ms = rx
+        self.remote = addr
+        if "seq" in pkt:
+            self.last_seq = pkt["seq"]
+            self.last_rx = rx
+            self._ack({"ack": self.last_seq, "armed": int(self.armed), "fs": int(was_failsafe),
+                       "rx": rx, "ap": rx + self.apply_ms})
+
+    def _ack(self, ack: dict):
+        if self.transport is None or self.remote is None or random.random() < self.drop:
+            return
+        data = json.dumps(ack).encode("utf-8")
+        if self.delay_ms:
+            asyncio.get_running_loop().call_later(self.delay_ms / 1000, self.transport.sendto, data, self.remote)
+        else:
+            self.transport.sendto(data, self.remote)
+
+    async def status_loop(self):
+        """Repeat the last ack with fs=1 while no packets arrive, like the sketch's failsafe branch."""
+        while True:
+            await asyncio.sleep(STATUS_MS / 1000)
+            if self.failsafe and self.last_seq is not None:
+                self._ack({"ack": self.last_seq, "armed": int(self.armed), "fs": 1,
+                           "rx": self.last_rx, "ap": self.last_rx + self.apply_ms})
+
+
+async def serve(host=ESP32_BIND, port=ESP32_PORT, **opts):
+    """Start an emulator; returns (transport, protocol). Port 0 picks a free port."""
+    loop = asyncio.get_running_loop()
+    transport, proto = await loop.create_datagram_endpoint(lambda: ESP32Emulator(**opts), local_addr=(host, port))
+    asyncio.create_task(proto.status_loop())
+    return transport, proto
+
+
+async def main():
+    transport, proto = await serve(drop=float(os.getenv("DROP", "0")), delay_ms=float(os.getenv("DELAY_MS", "0")))
+    print(f"ESP32 emulator on udp://{ESP32_BIND}:{ESP32_PORT}")
+    while True:
+        await asyncio.sleep(0.5)
+        print(f"armed={int(proto.armed)} failsafe={int(proto.failsafe)} seq={proto.last_seq} {proto.channels}", end="\r")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,4 +1,5 @@
-import asyncio, json, os, time, socket, signal
+import asyncio, json, os, time, socket, signal, hmac, hashlib, secrets, bisect, functools
+from collections import deque
 import websockets
 
 # ===== Config =====
@@ -7,53 +8,336 @@ ESP32_PORT = int(os.getenv("ESP32_PORT", "5005"))
 WS_BIND    = os.getenv("WS_BIND", "0.0.0.0")
 WS_PORT    = int(os.getenv("WS_PORT", "8443"))  # behind TLS terminator or use ws for quick test
 SHARED_TOKEN = os.getenv("TOKEN", "my-super-secret")
+# Accept old clients that put the token in every packet (first valid one authenticates the connection)
+LEGACY_TOKEN = os.getenv("LEGACY_TOKEN", "1") not in ("0", "false", "False")
+
+# Cars: CARS="rgt=192.168.1.84:5005,crawler=192.168.1.85:5005". Unset: one car, DEFAULT_CAR, at ESP32_HOST:ESP32_PORT
+DEFAULT_CAR = "car"
+
+def parse_cars(spec: str) -> dict:
+    cars = {}
+    for item in filter(None, (x.strip() for x in spec.split(","))):
+        car, _, addr = item.partition("=")
+        host, _, port = addr.rpartition(":")
+        cars[car.strip()] = (host, int(port))
+    return cars
+
+CARS = parse_cars(os.getenv("CARS", ""))
 
 # Failsafe
 FAILSAFE_MS = 500
 
+# Optional ack back-channel: packets get a "seq" and the sketch answers {"ack":seq,...} to the sender
+ESP32_ACK = os.getenv("ESP32_ACK", "0") in ("1", "true", "True")
+ACK_TIMEOUT_MS = int(os.getenv("ACK_TIMEOUT_MS", "500"))  # unacked after this long counts as lost
+LINK_REPORT_S = 1.0  # how often link metrics are pushed to dashboards
+
+# Federation: with UPSTREAM_URL set this relay is an edge. Local clients authenticate here and their
+# control is forwarded over one persistent connection to the home relay, which owns the cars and
+# driver arbitration; telemetry from home is fanned out to local dashboards.
+UPSTREAM_URL = os.getenv("UPSTREAM_URL", "")
+UPSTREAM_DELAY_MS = float(os.getenv("UPSTREAM_DELAY_MS", "0"))  # injected one-way link delay, for testing
+
 # Networking
 udp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-last_pkt_ms = 0
+last_pkt_ms = {}  # car -> monotonic ms of the last forwarded control packet
 
 # Control arbitration
-current_driver = None  # websocket object that currently holds control
+drivers = {}  # car -> Session that currently holds control of it
 clients = set()
 # --- add near top with other globals ---
 dashboards = set()  # a set of ws clients interested in telemetry
 
+links = {}  # car (ip, port) -> LinkStats, filled by send_udp() when ESP32_ACK is on
+upstream = None  # Upstream link to the home relay when running as an edge
+
 # Neutral payload (explicit ch1..ch8) — sketch expects ch1..ch8 or will default missing keys to 0.0
 NEUTRAL = {f"ch{i}": 0.0 for i in range(1, 9)}
+CHANNELS = tuple(f"ch{i}" for i in range(1, 10))
+
+def car_ids() -> list:
+    return list(CARS) or [DEFAULT_CAR]
+
+def default_car() -> str:
+    """Car for packets without a "car" field (legacy single-car clients): the first one."""
+    return next(iter(CARS), DEFAULT_CAR)
+
+def car_addr(car: str):
+    """UDP address of a car, or None for unknown car ids."""
+    if CARS:
+        return CARS.get(car)
+    return (ESP32_HOST, ESP32_PORT) if car == DEFAULT_CAR else None
+
+class Session:
+    """Per-connection state. Authentication happens once, then lives here."""
+
+    def __init__(self, ws):
+        self.ws = ws
+        self.role = "spectator"
+        self.authed = False
+        self.nonce = secrets.token_hex(16)
+        self.sid = None  # edge: this client's id on the upstream link
+        self.remote = {}  # home, on an edge's session: sid -> ForwardedSession
+
+    async def send(self, obj: dict):
+        await self.ws.send(json.dumps(obj))
+
+class ForwardedSession(Session):
+    """A client of an edge relay as seen by the home relay; replies go back over the edge link."""
+
+    def __init__(self, edge: Session, sid: int):
+        super().__init__(edge.ws)
+        self.edge = edge
+        self.sid = sid
+        self.authed = True  # the edge authenticated it
+
+    async def send(self, obj: dict):
+        await self.edge.send({"type": "fwd", "sid": self.sid, "pkt": obj})
+
+def auth_mac(nonce: str) -> str:
+    """Expected handshake answer: hex HMAC-SHA256 of the nonce keyed with the shared token."""
+    return hmac.new(SHARED_TOKEN.encode("utf-8"), nonce.encode("utf-8"), hashlib.sha256).hexdigest()
+
+def check_auth(sess: Session, pkt: dict) -> bool:
+    """Validate an unauthenticated packet: an HMAC answer, or a legacy per-packet token."""
+    if pkt.get("type") == "auth":
+        mac = pkt.get("mac")
+        return isinstance(mac, str) and hmac.compare_digest(mac.encode("utf-8"), auth_mac(sess.nonce).encode("utf-8"))
+    token = pkt.get("token")
+    return LEGACY_TOKEN and isinstance(token, str) and hmac.compare_digest(token.encode("utf-8"), SHARED_TOKEN.encode("utf-8"))
+
+def clamp(v, lo=-1.0, hi=1.0):
+    try:
+        fv = float(v)
+    except Exception:
+        return 0.0
+    return max(lo, min(hi, fv))
+
+class LinkStats:
+    """Last-hop metrics for one car: RTT, loss and apply latency from its acks.
+
+    Ack shape (from the sketch): {"ack": seq, "armed": 0|1, "fs": 0|1, "rx": ms, "ap": ms}
+    where rx/ap are the car's millis() at receive and at apply.
+    """
+
+    RTT_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+    WINDOW = 200  # recent packets used for loss rate, percentiles and apply latency
+
+    def __init__(self, car: str = DEFAULT_CAR):
+        self.car = car
+        self.seq = 0
+        self.pending = {}  # seq -> monotonic send time, oldest first
+        self.outcomes = deque(maxlen=self.WINDOW)  # True = acked, False = timed out
+        self.rtts = deque(maxlen=self.WINDOW)
+        self.applies = deque(maxlen=self.WINDOW)
+        self.hist = [0] * (len(self.RTT_BUCKETS_MS) + 1)
+        self.last_ack = None
+        self.last_ack_t = None
+
+    def next_seq(self, now: float) -> int:
+        self.expire(now)
+        self.seq += 1
+        self.pending[self.seq] = now
+        return self.seq
+
+    def expire(self, now: float):
+        limit = now - ACK_TIMEOUT_MS / 1000
+        while self.pending:
+            seq, sent = next(iter(self.pending.items()))
+            if sent > limit:
+                break
+            del self.pending[seq]
+            self.outcomes.append(False)
+
+    def on_ack(self, ack: dict, now: float):
+        self.last_ack = ack
+        self.last_ack_t = now
+        sent = self.pending.pop(ack.get("ack"), None)
+        if sent is None:
+            return  # late, duplicate, or a failsafe status repeat
+        rtt_ms = (now - sent) * 1000
+        self.outcomes.append(True)
+        self.rtts.append(rtt_ms)
+        self.hist[bisect.bisect_left(self.RTT_BUCKETS_MS, rtt_ms)] += 1
+        rx, ap = ack.get("rx"), ack.get("ap")
+        if isinstance(rx, (int, float)) and isinstance(ap, (int, float)):
+            self.applies.append(ap - rx)
+
+    def snapshot(self, now: float) -> dict:
+        self.expire(now)
+        rtts = sorted(self.rtts)
+
+        def pct(p):
+            return round(rtts[min(len(rtts) - 1, int(p * len(rtts)))], 2) if rtts else None
+
+        ack = self.last_ack or {}
+        return {
+            "seq": self.seq,
+            "acked_seq": ack.get("ack"),
+            "armed": bool(ack["armed"]) if "armed" in ack else None,
+            "failsafe": bool(ack["fs"]) if "fs" in ack else None,
+            "ack_age_ms": round((now - self.last_ack_t) * 1000) if self.last_ack_t is not None else None,
+            "loss": round(self.outcomes.count(False) / len(self.outcomes), 3) if self.outcomes else None,
+            "rtt_ms": {"p50": pct(0.5), "p95": pct(0.95), "max": round(rtts[-1], 2) if rtts else None},
+            "rtt_hist": dict(zip([str(b) for b in self.RTT_BUCKETS_MS] + ["inf"], self.hist)),
+            "apply_ms": round(sum(self.applies) / len(self.applies), 2) if self.applies else None,
+        }
+
+class AckProtocol(asyncio.DatagramProtocol):
+    """Receives car acks on the relay's UDP socket (the sketch replies to the sender address)."""
+
+    def datagram_received(self, data, addr):
+        try:
+            ack = json.loads(data)
+        except Exception:
+            return
+        link = links.get(addr[:2])
+        if link is not None and isinstance(ack, dict):
+            link.on_ack(ack, time.monotonic())
+
+@functools.lru_cache(maxsize=None)
+def resolve_host(host: str) -> str:
+    # acks come back from an IP, so key links by the resolved address
+    return socket.gethostbyname(host)
 
-def send_udp(payload: dict):
+def send_udp(payload: dict, car: str = DEFAULT_CAR):
+    host, port = car_addr(car)
+    addr = (host, port)
+    if ESP32_ACK:
+        addr = (resolve_host(host), port)
+        link = links.get(addr)
+        if link is None:
+            link = links[addr] = LinkStats(car)
+        payload = {**payload, "seq": link.next_seq(time.monotonic())}
     data = json.dumps(payload).encode("utf-8")
-    print(f"UDP -> {ESP32_HOST}:{ESP32_PORT} : {data}", end="\r")
-    udp_sock.sendto(data, (ESP32_HOST, ESP32_PORT))
+    print(f"UDP -> {host}:{port} : {data}", end="\r")
+    udp_sock.sendto(data, addr)
+
+async def start_ack_listener():
+    """Bind the UDP socket and read car acks on it (only used when ESP32_ACK is on)."""
+    udp_sock.bind(("0.0.0.0", 0))
+    loop = asyncio.get_running_loop()
+    transport, _ = await loop.create_datagram_endpoint(AckProtocol, sock=udp_sock)
+    return transport
+
+async def broadcast_dashboards(obj):
+    data = obj if isinstance(obj, str) else json.dumps(obj)
+    # copy to avoid set changed during iteration
+    for d in list(dashboards):
+        try:
+            await d.send(data)
+        except Exception:
+            dashboards.discard(d)
+
+async def link_reporter():
+    while True:
+        await asyncio.sleep(LINK_REPORT_S)
+        if dashboards and links:
+            now = time.monotonic()
+            await broadcast_dashboards({
+                "type": "link",
+                "cars": {link.car: link.snapshot(now) for link in links.values()},
+            })
 
 async def watchdog():
-    global last_pkt_ms
     while True:
         await asyncio.sleep(0.05)
-        if (time.monotonic() * 1000) - last_pkt_ms > FAILSAFE_MS:
-            send_udp(NEUTRAL)
+        now_ms = time.monotonic() * 1000
+        for car in car_ids():
+            if now_ms - last_pkt_ms.get(car, 0) > FAILSAFE_MS:
+                send_udp(NEUTRAL, car)
+
+async def acquire(sess: Session, car: str):
+    if not isinstance(car, str) or car_addr(car) is None:
+        await sess.send({"type": "error", "error": "unknown car", "car": car})
+    elif drivers.get(car) in (None, sess):
+        drivers[car] = sess
+        sess.role = "driver"
+        await sess.send({"type": "role", "role": "driver", "car": car})
+    else:
+        # optional: inform client someone else is driving
+        await sess.send({"type": "busy", "by": "driver", "car": car})
+
+async def forward_frame(sess: Session, frame: dict, ts=None):
+    """Forward one control frame to its car if this session drives it."""
+    car = frame.get("car") or default_car()
+    # Only the driver can command the car (ids are strings; anything else is malformed)
+    if not isinstance(car, str) or drivers.get(car) is not sess:
+        return
+    # Support both legacy {ax,ay} packets and new ch1..ch8 channel packets.
+    # If client sends channel-format data, forward those channels.
+    if any(k in frame for k in CHANNELS):
+        out = {k: clamp(frame[k]) if k in frame else 0.0 for k in CHANNELS}
+        send_udp(out, car)
+        last_pkt_ms[car] = int(time.monotonic() * 1000)
+
+        # broadcast telemetry to dashboards
+        if dashboards:
+            telem = {
+                "car": car,
+                "steering": out["ch1"],
+                "throttle": out["ch2"],
+                "winch": out["ch3"],
+                "lights": "on" if out["ch5"] > 0 else "off",
+                "gear": "high" if out["ch7"] < 0 else "low",
+                "dig": "locked rear" if out["ch8"] < 0 else ("2wd" if out["ch8"] == 0 else "4wd"),
+                "swaybar": "deactivated" if out["ch4"] > 0 else "activated",
+                "ts": frame.get("ts", ts or time.time())
+            }
+            await broadcast_dashboards(telem)
+    # Legacy: map ax/ay to ch1/ch2 for compatibility
+    elif "ax" in frame or "ay" in frame:
+        ax = clamp(frame.get("ax", 0.0))
+        ay = clamp(frame.get("ay", 0.0))
+        send_udp({"ch1": ax, "ch2": ay}, car)
+        last_pkt_ms[car] = int(time.monotonic() * 1000)
+
+async def handle_control(sess: Session, pkt: dict):
+    """Acquire requests and control frames from an authenticated session (local or via an edge)."""
+    if pkt.get("acquire") is True:
+        # {"acquire": true} takes the default (first) car; add "car" to pick another
+        await acquire(sess, pkt.get("car") or default_car())
+    elif pkt.get("type") == "batch":
+        # Several cars' frames multiplexed in one message:
+        # {"type":"batch","ts":...,"frames":[{"car":"rgt","ch1":...}, ...]}
+        ts = pkt.get("ts")
+        frames = pkt.get("frames")
+        for frame in frames if isinstance(frames, list) else ():
+            if isinstance(frame, dict):
+                await forward_frame(sess, frame, ts)
+    else:
+        await forward_frame(sess, pkt)
+
+async def handle_edge(edge: Session, pkt: dict):
+    """Home side of the federation link: {"type":"fwd","sid":n,"pkt":{...}} and {"type":"close","sid":n}."""
+    sid = pkt.get("sid")
+    if pkt.get("type") == "fwd" and isinstance(pkt.get("pkt"), dict):
+        sub = edge.remote.get(sid)
+        if sub is None:
+            sub = edge.remote[sid] = ForwardedSession(edge, sid)
+        try:
+            await handle_control(sub, pkt["pkt"])
+        except websockets.ConnectionClosed:
+            raise
+        except Exception as e:
+            # one bad packet must not end the link, and with it every other driver on that edge
+            print(f"Dropped packet from edge client {sid!r}: {e!r}")
+    elif pkt.get("type") == "close" and sid in edge.remote:
+        release(edge.remote.pop(sid))
+
+def release(sess: Session):
+    for car, driver in list(drivers.items()):
+        if driver is sess:
+            del drivers[car]
 
 async def handle_client(ws):
-    global current_driver, last_pkt_ms
     clients.add(ws)
-    role = "spectator"
-    await ws.send(json.dumps({"type": "hello", "role": role}))
+    sess = Session(ws)
+    cars = upstream.cars if upstream is not None else car_ids()
+    # The nonce is the auth challenge: answer with {"type":"auth","mac":auth_mac(nonce)}
+    await sess.send({"type": "hello", "role": sess.role, "nonce": sess.nonce, "cars": cars})
 
     try:
-        # # Simple control lock: first client becomes driver; can be improved with explicit "acquire/release"
-        # role = "spectator"
-        # if current_driver is None:
-        #     current_driver = ws
-        #     role = "driver"
-
-        # await ws.send(json.dumps({
-        #     "type": "hello",
-        #     "role": role,
-        # }))
-
         async for msg in ws:
             # Each message should be a JSON control packet
             try:
@@ -64,75 +348,42 @@ async def handle_client(ws):
             # allow dashboards to register
             if pkt.get("type") == "hello" and pkt.get("role") == "dashboard":
                 dashboards.add(ws)
-                role = "dashboard"
-                await ws.send(json.dumps({"type": "role", "role": "dashboard"}))
+                sess.role = "dashboard"
+                await sess.send({"type": "role", "role": "dashboard"})
                 continue
 
-            if pkt.get("token") != SHARED_TOKEN:
-                # optional: close or ignore
+            # Authenticate once per connection; authenticated packets skip the token entirely
+            if not sess.authed:
+                if not check_auth(sess, pkt):
+                    if pkt.get("type") == "auth":
+                        await sess.send({"type": "auth", "ok": False})
+                        await ws.close(code=4401, reason="auth failed")
+                        break
+                    # optional: close or ignore
+                    continue
+                sess.authed = True
+                if pkt.get("type") == "auth":
+                    await sess.send({"type": "auth", "ok": True})
+                    continue
+            elif pkt.get("type") == "auth":
                 continue
 
-            if pkt.get("acquire") is True:
-                if current_driver is None:
-                    current_driver = ws
-                    role = "driver"
-                    await ws.send(json.dumps({"type":"role","role":"driver"}))
-                else:
-                    # optional: inform client someone else is driving
-                    await ws.send(json.dumps({"type":"busy","by":"driver"}))
-                continue
-
-            # Only the driver can command the car
-            if current_driver is ws:
-                # Support both legacy {ax,ay} packets and new ch1..ch8 channel packets.
-                def clamp(v, lo=-1.0, hi=1.0):
-                    try:
-                        fv = float(v)
-                    except Exception:
-                        return 0.0
-                    return max(lo, min(hi, fv))
-
-                # If client sends channel-format data, forward those channels.
-                if any(k in pkt for k in ("ch1", "ch2", "ch3", "ch4", "ch5", "ch6", "ch7", "ch8", "ch9")):
-                    out = {}
-                    for i in range(1, 10):
-                        key = f"ch{i}"
-                        if key in pkt:
-                            out[key] = clamp(pkt.get(key, 0.0))
-                        else:
-                            out[key] = 0.0
-                    send_udp(out)
-                    last_pkt_ms = int(time.monotonic() * 1000)
-
-                    # broadcast telemetry to dashboards
-                    telem = {
-                        "steering": pkt["ch1"],
-                        "throttle": pkt["ch2"],
-                        "winch": pkt["ch3"],
-                        "lights": "on" if pkt["ch5"] > 0 else "off",
-                        "gear": "high" if pkt["ch7"] < 0 else "low",
-                        "dig": "locked rear" if pkt["ch8"] < 0 else ("2wd" if pkt["ch8"] == 0 else "4wd"),
-                        "swaybar": "deactivated" if pkt["ch4"] > 0 else "activated",
-                        "ts": pkt.get("ts", time.time())
-                    }
-                    # copy to avoid set changed during iteration
-                    for d in list(dashboards):
-                        try:
-                            await d.send(json.dumps(telem))
-                        except Exception:
-                            dashboards.discard(d)
-                # Legacy: map ax/ay to ch1/ch2 for compatibility
-                elif "ax" in pkt or "ay" in pkt:
-                    ax = clamp(pkt.get("ax", 0.0))
-                    ay = clamp(pkt.get("ay", 0.0))
-                    send_udp({"ch1": ax, "ch2": ay})
-                    last_pkt_ms = int(time.monotonic() * 1000)
+            if sess.role == "edge":
+                await handle_edge(sess, pkt)
+            elif pkt.get("type") == "hello" and pkt.get("role") == "edge":
+                if upstream is not None:
+                    continue  # edges connect to the home relay, not to another edge
+                # an edge multiplexes its clients over this connection and relays telemetry to its dashboards
+                sess.role = "edge"
+                dashboards.add(ws)
+                await sess.send({"type": "role", "role": "edge"})
+            elif upstream is not None:
+                if not upstream.forward(sess, pkt):
+                    # no home link: the client's reconnect loop will acquire again once it is back
+                    await ws.close(code=1013, reason="upstream down")
+                    break
             else:
-                # spectator can send "acquire": True to request control (optional)
-                if pkt.get("acquire"):
-                    if current_driver is None:
-                        current_driver = ws
-                        await ws.send(json.dumps({"type": "role", "role": "driver"}))
+                await handle_control(sess, pkt)
     except websockets.ConnectionClosed:
         pass
     finally:
@@ -140,20 +391,136 @@ async def handle_client(ws):
 
         if ws in dashboards:
             dashboards.discard(ws)
-        if current_driver is ws:
-            current_driver = None
+        if upstream is not None:
+            upstream.release(sess)
+        release(sess)
+        for sub in sess.remote.values():
+            release(sub)
+
+async def pump(queue: asyncio.Queue, handler):
+    """Hand (due, item) pairs to handler in order, each no earlier than its due time."""
+    while True:
+        due, item = await queue.get()
+        wait = due - time.monotonic()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        await handler(item)
+
+class Upstream:
+    """Edge side of the federation link: one authenticated, persistent connection to the home relay.
+
+    Local sessions get a sid the first time they send control; everything they send after
+    authenticating goes up as {"type":"fwd","sid":n,"pkt":{...}} and home's replies come back
+    the same way. Anything else from home (telemetry, link metrics) goes to local dashboards.
+    """
+
+    def __init__(self, url: str, delay_ms: float = 0.0):
+        self.url = url
+        self.delay = delay_ms / 1000
+        self.cars = [DEFAULT_CAR]
+        self.sessions = {}  # sid -> local Session
+        self.next_sid = 0
+        self.outbox = None  # (due, data) queue, only while linked
+
+    def send(self, obj: dict):
+        if self.outbox is not None:
+            self.outbox.put_nowait((time.monotonic() + self.delay, json.dumps(obj)))
+
+    def forward(self, sess: Session, pkt: dict) -> bool:
+        """Queue pkt for home; False while there is no link (home's failsafe has the car)."""
+        if self.outbox is None:
+            return False
+        if sess.sid is None:
+            self.next_sid += 1
+            sess.sid = self.next_sid
+            self.sessions[sess.sid] = sess
+        self.send({"type": "fwd", "sid": sess.sid, "pkt": pkt})
+        return True
+
+    def release(self, sess: Session):
+        if sess.sid is not None and self.sessions.pop(sess.sid, None) is not None:
+            self.send({"type": "close", "sid": sess.sid})
+
+    async def deliver(self, msg: str):
+        try:
+            pkt = json.loads(msg)
+        except Exception:
+            return
+        if pkt.get("type") == "fwd":
+            sess = self.sessions.get(pkt.get("sid"))
+            if sess is not None:
+                try:
+                    await sess.send(pkt.get("pkt"))
+                except Exception:
+                    pass
+        elif pkt.get("type") not in ("hello", "auth", "role"):
+            await broadcast_dashboards(msg)
+
+    async def link_once(self):
+        async with websockets.connect(self.url, max_size=2**16) as ws:
+            hello = json.loads(await ws.recv())
+            self.cars = hello.get("cars", self.cars)
+            await ws.send(json.dumps({"type": "auth", "mac": auth_mac(hello.get("nonce", ""))}))
+            if not json.loads(await ws.recv()).get("ok"):
+                print("Upstream rejected authentication (check TOKEN).")
+                return
+            await ws.send(json.dumps({"type": "hello", "role": "edge"}))
+            inbox = asyncio.Queue()
+            self.outbox = asyncio.Queue()
+            tasks = [asyncio.create_task(pump(self.outbox, ws.send)),
+                     asyncio.create_task(pump(inbox, self.deliver))]
+            print(f"Edge linked to {self.url}")
+            try:
+                async for msg in ws:
+                    inbox.put_nowait((time.monotonic() + self.delay, msg))
+            finally:
+                self.outbox = None
+                for t in tasks:
+                    t.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                # home released these clients' cars; make them reconnect and acquire again
+                for sess in list(self.sessions.values()):
+                    sess.sid = None
+                    try:
+                        await sess.ws.close(code=1012, reason="upstream lost")
+                    except Exception:
+                        pass
+                self.sessions.clear()
+
+    async def run(self):
+        # Simple reconnect loop with backoff
+        delay = 1.0
+        while True:
+            try:
+                await self.link_once()
+                delay = 1.0
+            except (OSError, websockets.InvalidURI, websockets.InvalidHandshake, websockets.ConnectionClosed) as e:
+                print("Upstream error:", e)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 10)
 
 async def main():
-    # watchdog
-    asyncio.create_task(watchdog())
+    global upstream
+    if UPSTREAM_URL:
+        # edge: no cars here, home runs the watchdog and talks UDP
+        upstream = Upstream(UPSTREAM_URL, UPSTREAM_DELAY_MS)
+        asyncio.create_task(upstream.run())
+    else:
+        # watchdog
+        asyncio.create_task(watchdog())
+        if ESP32_ACK:
+            await start_ack_listener()
+            asyncio.create_task(link_reporter())
     # WebSocket server (plain ws for local test; for production, put behind TLS reverse proxy like Caddy/Nginx)
-    async with websockets.serve(handle_client, WS_BIND, WS_PORT, max_size=2**16):
-        print(f"Relay listening on ws://{WS_BIND}:{WS_PORT}")
+    async with websockets.serve(handle_client, WS_BIND, WS_PORT, max_size=2**16) as server:
+        port = server.sockets[0].getsockname()[1]
+        print(f"Relay listening on ws://{WS_BIND}:{port}")
         await asyncio.Future()  # run forever
 
 def _shutdown(*_):
     # Neutral on exit
-    send_udp(NEUTRAL)
+    for car in ([] if UPSTREAM_URL else car_ids()):
+        send_udp(NEUTRAL, car)
     raise SystemExit
 
 if __name__ == "__main__":
@@ -0,0 +1,166 @@
+import asyncio
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import time
+
+import websockets
+
+from src.server import esp32_emulator, relay
+
+RELAY = os.path.join(os.path.dirname(__file__), "..", "src", "server", "relay.py")
+CHANNELS = {f"ch{i}": 0.0 for i in range(1, 10)}
+
+
+def _start_relay(tmp_path, name, ready, **env):
+    """Run relay.py as its own process on a free port; returns (proc, ws url) once `ready` is logged."""
+    log = tmp_path / f"{name}.log"
+    out = open(log, "w")
+    proc = subprocess.Popen([sys.executable, "-u", RELAY], stdout=out, stderr=subprocess.STDOUT,
+                            env={**os.environ, "WS_BIND": "127.0.0.1", "WS_PORT": "0", **env})
+    out.close()
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        text = log.read_text()
+        port = re.search(r"Relay listening on ws://127\.0\.0\.1:(\d+)", text)
+        if port and ready in text:
+            return proc, f"ws://127.0.0.1:{port.group(1)}"
+        time.sleep(0.05)
+    proc.kill()
+    raise AssertionError(f"{name} did not start:\n{log.read_text()}")
+
+
+def _wait_log(tmp_path, name, text):
+    deadline = time.time() + 10
+    while text not in (tmp_path / f"{name}.log").read_text():
+        assert time.time() < deadline, f"{name} never logged {text!r}"
+        time.sleep(0.05)
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def _recv_type(ws, typ):
+    while True:
+        pkt = json.loads(await asyncio.wait_for(ws.recv(), timeout=3.0))
+        if pkt.get("type") == typ:
+            return pkt
+
+
+async def _client(url):
+    ws = await websockets.connect(url)
+    hello = json.loads(await ws.recv())
+    await ws.send(json.dumps({"type": "auth", "mac": relay.auth_mac(hello["nonce"])}))
+    await _recv_type(ws, "auth")
+    return ws, hello
+
+
+def test_edges_forward_to_home_which_arbitrates(tmp_path):
+    async def body():
+        transport, car = await esp32_emulator.serve("127.0.0.1", 0)
+        car_port = transport.get_extra_info("sockname")[1]
+        procs = []
+        try:
+            home, home_url = _start_relay(tmp_path, "home", "Relay listening",
+                                          CARS=f"rgt=127.0.0.1:{car_port}")
+            procs.append(home)
+            edge_a, url_a = _start_relay(tmp_path, "edge_a", "Edge linked", UPSTREAM_URL=home_url)
+            procs.append(edge_a)
+            edge_b, url_b = _start_relay(tmp_path, "edge_b", "Edge linked", UPSTREAM_URL=home_url,
+                                         UPSTREAM_DELAY_MS="60")
+            procs.append(edge_b)
+
+            dash = await websockets.connect(url_b)
+            await dash.send(json.dumps({"type": "hello", "role": "dashboard"}))
+            await _recv_type(dash, "role")
+
+            a, hello = await _client(url_a)
+            assert hello["cars"] == ["rgt"]
+            await a.send(json.dumps({"acquire": True, "car": "rgt"}))
+            assert (await _recv_type(a, "role"))["role"] == "driver"
+
+            # the driver lives on home: a client of the other edge is told it is busy, after a full
+            # round trip over the delayed link
+            b, _ = await _client(url_b)
+            t0 = time.monotonic()
+            await b.send(json.dumps({"acquire": True, "car": "rgt"}))
+            assert (await _recv_type(b, "busy"))["car"] == "rgt"
+            assert time.monotonic() - t0 >= 0.12
+
+            await b.send(json.dumps({"type": "batch", "frames": [{**CHANNELS, "car": "rgt", "ch1": -1.0}]}))
+            await a.send(json.dumps({"type": "batch", "frames": [{**CHANNELS, "car": "rgt", "ch1": 0.5}]}))
+            telem = json.loads(await asyncio.wait_for(dash.recv(), timeout=3.0))
+            assert telem["car"] == "rgt" and telem["steering"] == 0.5
+            assert [p["ch1"] for p in car.received if p["ch1"]] == [0.5]
+
+            # leaving edge A releases the car on home
+            await a.close()
+            await asyncio.sleep(0.2)
+            await b.send(json.dumps({"acquire": True, "car": "rgt"}))
+            assert (await _recv_type(b, "role"))["role"] == "driver"
+            await b.send(json.dumps({"type": "batch", "frames": [{**CHANNELS, "car": "rgt", "ch1": -0.25}]}))
+            await asyncio.sleep(0.3)
+            assert [p["ch1"] for p in car.received if p["ch1"]] == [0.5, -0.25]
+            await b.close()
+            await dash.close()
+        finally:
+            for proc in procs:
+                proc.terminate()
+                proc.wait(timeout=5)
+            transport.close()
+
+    asyncio.run(body())
+
+
+def test_edge_drops_clients_when_home_goes_away(tmp_path):
+    async def body():
+        home, home_url = _start_relay(tmp_path, "home", "Relay listening")
+        edge, url = _start_relay(tmp_path, "edge", "Edge linked", UPSTREAM_URL=home_url)
+        try:
+            ws, _ = await _client(url)
+            await ws.send(json.dumps({"acquire": True}))
+            assert (await _recv_type(ws, "role"))["role"] == "driver"
+            home.terminate()
+            home.wait(timeout=5)
+            await asyncio.wait_for(ws.wait_closed(), timeout=3.0)
+            assert ws.close_code == 1012
+        finally:
+            for proc in (home, edge):
+                if proc.poll() is None:
+                    proc.terminate()
+                    proc.wait(timeout=5)
+
+    asyncio.run(body())
+
+
+def test_edge_started_before_home_turns_clients_away_until_linked(tmp_path):
+    async def body():
+        home_port = _free_port()
+        edge, url = _start_relay(tmp_path, "edge", "Relay listening",
+                                 UPSTREAM_URL=f"ws://127.0.0.1:{home_port}")
+        home = None
+        try:
+            ws, _ = await _client(url)
+            await ws.send(json.dumps({"acquire": True}))
+            await asyncio.wait_for(ws.wait_closed(), timeout=3.0)
+            assert ws.close_code == 1013
+
+            home, _ = _start_relay(tmp_path, "home", "Relay listening", WS_PORT=str(home_port))
+            _wait_log(tmp_path, "edge", "Edge linked")
+            ws, _ = await _client(url)
+            await ws.send(json.dumps({"acquire": True}))
+            assert (await _recv_type(ws, "role"))["role"] == "driver"
+            await ws.close()
+        finally:
+            for proc in (edge, home):
+                if proc is not None:
+                    proc.terminate()
+                    proc.wait(timeout=5)
+
+    asyncio.run(body())
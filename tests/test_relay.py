@@ -0,0 +1,281 @@
+import asyncio
+import json
+import socket
+
+import websockets
+
+from src.server import esp32_emulator, relay
+
+CHANNELS = {f"ch{i}": 0.0 for i in range(1, 10)}
+
+
+async def _with_relay(body, monkeypatch):
+    """Run body(url, sent) against an in-process relay; sent collects (car, payload) UDP sends."""
+    sent = []
+    monkeypatch.setattr(relay, "send_udp", lambda payload, car=relay.DEFAULT_CAR: sent.append((car, payload)))
+    monkeypatch.setattr(relay, "drivers", {})
+    monkeypatch.setattr(relay, "last_pkt_ms", {})
+    monkeypatch.setattr(relay, "clients", set())
+    monkeypatch.setattr(relay, "dashboards", set())
+    async with websockets.serve(relay.handle_client, "127.0.0.1", 0) as server:
+        port = server.sockets[0].getsockname()[1]
+        await body(f"ws://127.0.0.1:{port}", sent)
+
+
+async def _recv_type(ws, typ):
+    while True:
+        pkt = json.loads(await asyncio.wait_for(ws.recv(), timeout=2.0))
+        if pkt.get("type") == typ:
+            return pkt
+
+
+def test_hmac_handshake_then_tokenless_control(monkeypatch):
+    async def body(url, sent):
+        async with websockets.connect(url) as ws:
+            hello = json.loads(await ws.recv())
+            await ws.send(json.dumps({"type": "auth", "mac": relay.auth_mac(hello["nonce"])}))
+            assert (await _recv_type(ws, "auth"))["ok"] is True
+            await ws.send(json.dumps({"acquire": True}))
+            assert (await _recv_type(ws, "role"))["role"] == "driver"
+            await ws.send(json.dumps({**CHANNELS, "ch1": 0.5, "ch2": 2.0}))
+            await ws.send(json.dumps({"ax": 0.1}))
+            await asyncio.sleep(0.1)
+        assert sent[0][1]["ch1"] == 0.5 and sent[0][1]["ch2"] == 1.0
+        assert sent[1] == ("car", {"ch1": 0.1, "ch2": 0.0})
+
+    asyncio.run(_with_relay(body, monkeypatch))
+
+
+def test_bad_mac_closes_connection(monkeypatch):
+    async def body(url, sent):
+        async with websockets.connect(url) as ws:
+            await ws.recv()
+            await ws.send(json.dumps({"type": "auth", "mac": "00" * 32}))
+            assert (await _recv_type(ws, "auth"))["ok"] is False
+            await asyncio.wait_for(ws.wait_closed(), timeout=2.0)
+            assert ws.close_code == 4401
+
+    asyncio.run(_with_relay(body, monkeypatch))
+
+
+def test_unauthenticated_packets_are_ignored(monkeypatch):
+    async def body(url, sent):
+        async with websockets.connect(url) as ws:
+            await ws.recv()
+            await ws.send(json.dumps({"acquire": True, "token": "wrong"}))
+            await ws.send(json.dumps({"ch1": 0.5}))
+            await asyncio.sleep(0.1)
+        assert sent == []
+        assert relay.drivers == {}
+
+    asyncio.run(_with_relay(body, monkeypatch))
+
+
+def test_legacy_token_authenticates_once(monkeypatch):
+    async def body(url, sent):
+        async with websockets.connect(url) as ws:
+            await ws.recv()
+            await ws.send(json.dumps({"acquire": True, "token": relay.SHARED_TOKEN}))
+            assert (await _recv_type(ws, "role"))["role"] == "driver"
+            await ws.send(json.dumps({**CHANNELS, "ch1": 0.25, "token": relay.SHARED_TOKEN}))
+            await asyncio.sleep(0.1)
+        assert sent[0][1]["ch1"] == 0.25
+
+    asyncio.run(_with_relay(body, monkeypatch))
+
+
+def test_legacy_token_can_be_disabled(monkeypatch):
+    monkeypatch.setattr(relay, "LEGACY_TOKEN", False)
+
+    async def body(url, sent):
+        async with websockets.connect(url) as ws:
+            await ws.recv()
+            await ws.send(json.dumps({"acquire": True, "token": relay.SHARED_TOKEN}))
+            await ws.send(json.dumps({"ch1": 0.25, "token": relay.SHARED_TOKEN}))
+            await asyncio.sleep(0.1)
+        assert sent == []
+
+    asyncio.run(_with_relay(body, monkeypatch))
+
+
+async def _authed(url):
+    ws = await websockets.connect(url)
+    hello = json.loads(await ws.recv())
+    await ws.send(json.dumps({"type": "auth", "mac": relay.auth_mac(hello["nonce"])}))
+    await _recv_type(ws, "auth")
+    return ws
+
+
+def test_parse_cars():
+    assert relay.parse_cars("rgt=10.0.0.2:5005, crawler=esp.local:5006") == {
+        "rgt": ("10.0.0.2", 5005), "crawler": ("esp.local", 5006)}
+    assert relay.parse_cars("") == {}
+
+
+def test_batch_drives_several_cars_over_one_connection(monkeypatch):
+    monkeypatch.setattr(relay, "CARS", relay.parse_cars("rgt=10.0.0.2:5005,crawler=10.0.0.3:5005"))
+
+    async def body(url, sent):
+        ws = await _authed(url)
+        for car in ("rgt", "crawler"):
+            await ws.send(json.dumps({"acquire": True, "car": car}))
+            assert (await _recv_type(ws, "role")) == {"type": "role", "role": "driver", "car": car}
+        other = await _authed(url)
+        await other.send(json.dumps({"acquire": True, "car": "crawler"}))
+        assert (await _recv_type(other, "busy"))["car"] == "crawler"
+        await other.send(json.dumps({"acquire": True, "car": "nope"}))
+        assert (await _recv_type(other, "error"))["car"] == "nope"
+
+        await ws.send(json.dumps({"type": "batch", "ts": 1.0, "frames": [
+            {**CHANNELS, "car": "rgt", "ch1": 0.5},
+            {**CHANNELS, "car": "crawler", "ch1": -0.5},
+        ]}))
+        await other.send(json.dumps({"type": "batch", "frames": [{**CHANNELS, "car": "crawler", "ch1": 1.0}]}))
+        await asyncio.sleep(0.1)
+        assert [(car, p["ch1"]) for car, p in sent] == [("rgt", 0.5), ("crawler", -0.5)]
+
+        await ws.close()
+        await asyncio.sleep(0.05)
+        assert relay.drivers == {}
+        await other.send(json.dumps({"acquire": True, "car": "crawler"}))
+        assert (await _recv_type(other, "role"))["car"] == "crawler"
+        await other.close()
+
+    asyncio.run(_with_relay(body, monkeypatch))
+
+
+def test_malformed_car_ids_do_not_drop_the_connection(monkeypatch):
+    async def body(url, sent):
+        ws = await _authed(url)
+        await ws.send(json.dumps({"acquire": True, "car": [1]}))
+        assert (await _recv_type(ws, "error"))["car"] == [1]
+        await ws.send(json.dumps({"acquire": True}))
+        assert (await _recv_type(ws, "role"))["role"] == "driver"
+        await ws.send(json.dumps({"type": "batch", "frames": [
+            {**CHANNELS, "car": [1], "ch1": 1.0},
+            {**CHANNELS, "car": {"x": 1}, "ch1": 1.0},
+            {**CHANNELS, "car": "car", "ch1": 0.5},
+        ]}))
+        await ws.send(json.dumps({"type": "batch", "frames": 5}))
+        await asyncio.sleep(0.1)
+        assert [(car, p["ch1"]) for car, p in sent] == [("car", 0.5)]
+        await ws.close()
+
+    asyncio.run(_with_relay(body, monkeypatch))
+
+
+def test_bad_packet_from_one_edge_client_keeps_the_link(monkeypatch):
+    forward_frame = relay.forward_frame
+
+    async def failing_forward_frame(sess, frame, ts=None):
+        if "boom" in frame:
+            raise ValueError("boom")
+        await forward_frame(sess, frame, ts)
+
+    monkeypatch.setattr(relay, "forward_frame", failing_forward_frame)
+
+    async def body(url, sent):
+        edge = await _authed(url)
+        await edge.send(json.dumps({"type": "hello", "role": "edge"}))
+        await _recv_type(edge, "role")
+        await edge.send(json.dumps({"type": "fwd", "sid": 1, "pkt": {"acquire": True}}))
+        reply = await _recv_type(edge, "fwd")
+        assert reply["sid"] == 1 and reply["pkt"]["role"] == "driver"
+
+        await edge.send(json.dumps({"type": "fwd", "sid": 2, "pkt": {"boom": 1}}))
+        await edge.send(json.dumps({"type": "fwd", "sid": 1, "pkt": {**CHANNELS, "ch1": 0.5}}))
+        await asyncio.sleep(0.1)
+        assert edge.open
+        assert [p["ch1"] for car, p in sent] == [0.5]
+        assert relay.drivers["car"].sid == 1
+        await edge.close()
+
+    asyncio.run(_with_relay(body, monkeypatch))
+
+
+async def _with_car(body, monkeypatch, **opts):
+    """Run body(proto) with ESP32_ACK on and the relay's UDP pointed at an emulated car."""
+    monkeypatch.setattr(relay, "ESP32_ACK", True)
+    monkeypatch.setattr(relay, "udp_sock", socket.socket(socket.AF_INET, socket.SOCK_DGRAM))
+    monkeypatch.setattr(relay, "links", {})
+    transport, proto = await esp32_emulator.serve("127.0.0.1", 0, **opts)
+    monkeypatch.setattr(relay, "ESP32_HOST", "127.0.0.1")
+    monkeypatch.setattr(relay, "ESP32_PORT", transport.get_extra_info("sockname")[1])
+    ack_transport = await relay.start_ack_listener()
+    try:
+        await body(proto)
+    finally:
+        ack_transport.close()
+        transport.close()
+
+
+def _link():
+    (link,) = relay.links.values()
+    return link.snapshot(relay.time.monotonic())
+
+
+def test_acks_give_rtt_and_car_state(monkeypatch):
+    async def body(proto):
+        for _ in range(20):
+            relay.send_udp(relay.NEUTRAL)
+            await asyncio.sleep(0.005)
+        await asyncio.sleep(0.05)
+        snap = _link()
+        assert [p["seq"] for p in proto.received] == list(range(1, 21))
+        assert snap["acked_seq"] == 20 and snap["loss"] == 0.0
+        assert snap["armed"] is True and snap["failsafe"] is False
+        assert snap["rtt_ms"]["p50"] >= 3.0
+        assert snap["apply_ms"] == 2.0
+        assert sum(snap["rtt_hist"].values()) == 20
+
+    asyncio.run(_with_car(body, monkeypatch, delay_ms=3, apply_ms=2))
+
+
+def test_unacked_packets_count_as_loss(monkeypatch):
+    monkeypatch.setattr(relay, "ACK_TIMEOUT_MS", 50)
+
+    async def body(proto):
+        for _ in range(10):
+            relay.send_udp(relay.NEUTRAL)
+        await asyncio.sleep(0.1)
+        snap = _link()
+        assert snap["loss"] == 1.0 and snap["acked_seq"] is None
+
+    asyncio.run(_with_car(body, monkeypatch, drop=1.0))
+
+
+def test_failsafe_status_is_reported(monkeypatch):
+    monkeypatch.setattr(esp32_emulator, "FAILSAFE_MS", 50)
+    monkeypatch.setattr(esp32_emulator, "STATUS_MS", 20)
+
+    async def body(proto):
+        relay.send_udp(relay.NEUTRAL)
+        await asyncio.sleep(0.02)
+        assert _link()["failsafe"] is True  # first packet arrived after a long silence
+        relay.send_udp(relay.NEUTRAL)
+        await asyncio.sleep(0.02)
+        assert _link()["failsafe"] is False
+        await asyncio.sleep(0.15)
+        snap = _link()
+        assert snap["failsafe"] is True and snap["acked_seq"] == 2 and snap["loss"] == 0.0
+
+    asyncio.run(_with_car(body, monkeypatch))
+
+
+def test_link_metrics_reach_dashboards(monkeypatch):
+    monkeypatch.setattr(relay, "LINK_REPORT_S", 0.02)
+
+    async def body(url, sent):
+        stats = relay.LinkStats("rgt")
+        stats.on_ack({"ack": stats.next_seq(0.0), "armed": 1, "fs": 0, "rx": 5, "ap": 6}, 0.004)
+        monkeypatch.setattr(relay, "links", {("10.0.0.2", 5005): stats})
+        reporter = asyncio.create_task(relay.link_reporter())
+        async with websockets.connect(url) as ws:
+            await ws.send(json.dumps({"type": "hello", "role": "dashboard"}))
+            link = await _recv_type(ws, "link")
+        reporter.cancel()
+        car = link["cars"]["rgt"]
+        assert car["rtt_ms"]["p50"] == 4.0 and car["rtt_hist"]["5"] == 1
+        assert car["apply_ms"] == 1 and car["armed"] is True
+
+    asyncio.run(_with_relay(body, monkeypatch))